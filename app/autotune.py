@@ -0,0 +1,272 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from subprocess import DEVNULL, check_call, check_output
+from video import FAN_RESOLUTION, FFMPEG, FFPROBE, Video
+
+
+# creating log file
+log_file = os.path.join('..', 'autotune.log')
+if not os.path.isfile(log_file) or \
+        os.path.getsize(log_file) > 5120:
+    open(log_file, 'w').close()
+fh = logging.FileHandler(log_file, mode="a")
+ftm = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+fh.setFormatter(ftm)
+logger = logging.getLogger('autotune')
+logger.addHandler(fh)
+logger.setLevel(logging.DEBUG)
+
+# libvmaf model shipped with ffmpeg (forward slashes: it goes to filter graph)
+VMAF_MODEL = '../ffmpeg/model/vmaf_v0.6.1.json'
+# decisions of `Autotuner.tune`, one per source file content
+CACHE_FILE = os.path.join('..', 'media', 'autotune.json')
+
+# candidate settings, tried as cartesian product
+BITRATES = (400, 600, 800, 1000)  # kbit/s
+PRESETS = ('veryfast', 'medium')
+HEIGHTS = (None, 720)  # None keeps source resolution
+
+
+class Autotuner():
+    def __init__(self,
+                 target_vmaf: float = 93.0,
+                 candidates: list[dict] | None = None,
+                 workers: int | None = None) -> None:
+        """Picks the smallest encoding of a clip that meets VMAF target.
+
+        Args:
+            target_vmaf (float): min VMAF score (0-100) of encoded file.
+                Defaults to 93, which is hardly distinguishable from source.
+            candidates (list[dict], optional): encoder settings to try
+                (see `video.DEFAULT_SETTINGS`). Defaults to product of
+                `BITRATES`, `PRESETS` and `HEIGHTS`.
+            workers (int, optional): number of parallel encodes.
+                Defaults to half of CPU count, as x264 is multithreaded too.
+        """
+        if not 0 <= target_vmaf <= 100:
+            raise ValueError('VMAF target must be between 0 and 100')
+        self.target_vmaf = target_vmaf
+        if candidates is None:
+            candidates = [
+                {'bitrate': bitrate, 'preset': preset, 'height': height}
+                for bitrate, preset, height
+                in product(BITRATES, PRESETS, HEIGHTS)
+            ]
+        self.candidates = candidates
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+
+        self._cache = {}
+        # uploads are tuned in own threads; tuning one at a time keeps
+        # cache consistent and never tunes the same clip twice
+        self._lock = threading.Lock()
+        if os.path.isfile(CACHE_FILE):
+            with open(CACHE_FILE, 'r') as file:
+                self._cache = json.load(file)
+        logger.debug(f'{len(self._cache)} cached decisions loaded')
+
+    @staticmethod
+    def get_resolution(path: str) -> tuple[int, int]:
+        """Returns width and height of first video stream.
+
+        Args:
+            path (str): video file path
+
+        Returns:
+            tuple[int, int]: width and height in px
+        """
+        output = check_output([
+            FFPROBE, '-v', 'quiet', '-i', path, '-select_streams', 'v:0',
+            '-show_entries', 'stream=width,height', '-of', 'csv=p=0'
+        ]).decode()
+        width, height = output.strip().split(',')[:2]
+        return int(width), int(height)
+
+    @staticmethod
+    def score(reference: str, distorted: str) -> float:
+        """Calculates VMAF score of distorted file against reference.
+
+        Distorted file is scaled back to reference resolution before
+        comparison, as VMAF requires equal frame sizes.
+
+        Args:
+            reference (str): source video file path
+            distorted (str): encoded video file path
+
+        Returns:
+            float: mean VMAF score (0-100)
+        """
+        width, height = Autotuner.get_resolution(reference)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # relative path avoids escaping of `:` in windows paths
+            log_path = os.path.relpath(
+                os.path.join(tmp_dir, 'vmaf.json')).replace('\\', '/')
+            check_call([
+                FFMPEG, '-v', 'quiet', '-i', distorted, '-i', reference,
+                '-lavfi',
+                f'[0:v]scale={width}:{height}:flags=bicubic[dist];'
+                f'[1:v]null[ref];'
+                f'[dist][ref]libvmaf=model=path={VMAF_MODEL}:'
+                f'log_fmt=json:log_path={log_path}',
+                '-f', 'null', '-'
+            ], stdout=DEVNULL, stderr=DEVNULL)
+            with open(log_path, 'r') as file:
+                result = json.load(file)
+        return result['pooled_metrics']['vmaf']['mean']
+
+    @staticmethod
+    def get_fitted_reference(video: Video, tmp_dir: str) -> str:
+        """Fits video to holofan display losslessly (see `Video.fan_fit`).
+
+        Made once per tuning, so candidates encoded with `fan_fit` are
+        compared to what fan would show without fitting every time.
+
+        Args:
+            video (Video): source video file
+            tmp_dir (str): folder for fitted file
+
+        Returns:
+            str: fitted file path
+        """
+        output_path = os.path.join(tmp_dir, 'reference.mkv')
+        check_call([
+            FFMPEG, '-v', 'quiet', '-y', '-i', video.path,
+            '-i', Video.get_fan_mask(FAN_RESOLUTION),
+            '-filter_complex', f'{Video.fan_fit(FAN_RESOLUTION)}[fit]',
+            '-map', '[fit]', '-c:v', 'libx264', '-qp', '0',
+            '-preset', 'ultrafast', output_path
+        ], stdout=DEVNULL, stderr=DEVNULL)
+        return output_path
+
+    @staticmethod
+    def get_key(video: Video) -> str:
+        """Returns cache key of video file: sha1 of its content.
+
+        Args:
+            video (Video): video file
+
+        Returns:
+            str: hex digest
+        """
+        digest = hashlib.sha1()
+        with open(video.path, 'rb') as file:
+            while chunk := file.read(2**20):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _save_cache(self):
+        """Writes decisions to `CACHE_FILE` atomically."""
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp_path = CACHE_FILE + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self._cache, file, indent=4)
+        os.replace(tmp_path, CACHE_FILE)
+
+    def _try(self,
+             video: Video,
+             settings: dict,
+             tmp_dir: str,
+             reference: str) -> dict:
+        """Encodes video with given settings and measures result.
+
+        Args:
+            video (Video): source video file
+            settings (dict): encoder settings
+            tmp_dir (str): folder for encoded file
+            reference (str): file path to compare with
+
+        Returns:
+            dict: settings, encoded file path, size, encoding time and VMAF
+        """
+        # the winner is kept as `video.encoded_path()`, so the same
+        # container is used as for source
+        output_path = os.path.join(
+            tmp_dir,
+            f'{Video.settings_tag(settings)}{os.path.splitext(video.path)[1]}')
+        start = time.perf_counter()
+        video.encode(settings, output_path)
+        encode_time = time.perf_counter() - start
+        trial = {
+            'settings': settings,
+            'path': output_path,
+            'size': os.path.getsize(output_path),
+            'time': encode_time,
+            'vmaf': Autotuner.score(reference, output_path),
+        }
+        logger.debug(f'{Video.settings_tag(settings)}: '
+                     f'{trial["size"]} bytes, {encode_time:.1f} s, '
+                     f'VMAF {trial["vmaf"]:.2f}')
+        return trial
+
+    def tune(self, video: Video) -> dict:
+        """Selects encoder settings for video and assigns them to it.
+
+        All candidates are encoded in parallel and scored with VMAF. The
+        smallest (then fastest to encode) one meeting `target_vmaf` wins;
+        if none meets it, the one with the highest score is used. The
+        winning transcode is kept as `video.encoded_path()`, and decision is
+        cached by file content, so the same clip is tuned only once.
+        `fan_fit` setting of video is kept for all candidates, which are
+        then compared to source fitted once (see `get_fitted_reference`).
+
+        Args:
+            video (Video): video file to tune
+
+        Returns:
+            dict: selected encoder settings
+        """
+        with self._lock:
+            return self._tune(video)
+
+    def _tune(self, video: Video) -> dict:
+        """Selects encoder settings for video, see `tune`."""
+        fan_fit = video.encode_settings.get('fan_fit', False)
+        key = f'{Autotuner.get_key(video)}:{self.target_vmaf}'
+        if fan_fit:
+            key += ':fit'
+        if key in self._cache:
+            settings = self._cache[key]
+            logger.info(f'Cached settings for {video.name}: '
+                        f'{Video.settings_tag(settings)}')
+            video.encode_settings = settings
+            return settings
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            reference = video.path
+            if fan_fit:
+                reference = Autotuner.get_fitted_reference(video, tmp_dir)
+            with ThreadPoolExecutor(self.workers) as executor:
+                trials = list(executor.map(
+                    lambda settings: self._try(video, settings, tmp_dir,
+                                               reference),
+                    [{**candidate, 'fan_fit': fan_fit}
+                     for candidate in self.candidates]
+                ))
+
+            passed = [t for t in trials if t['vmaf'] >= self.target_vmaf]
+            if passed:
+                best = min(passed, key=lambda t: (t['size'], t['time']))
+            else:
+                best = max(trials, key=lambda t: t['vmaf'])
+                logger.warning(f'No settings meet VMAF {self.target_vmaf} '
+                               f'for {video.name}')
+
+            settings = best['settings']
+            encoded_path = video.encoded_path(settings)
+            os.makedirs(os.path.dirname(encoded_path), exist_ok=True)
+            shutil.move(best['path'], encoded_path)
+
+        logger.info(f'Selected settings for {video.name}: '
+                    f'{Video.settings_tag(settings)}, {best["size"]} bytes, '
+                    f'VMAF {best["vmaf"]:.2f}')
+        video.encode_settings = settings
+        self._cache[key] = settings
+        self._save_cache()
+        return settings
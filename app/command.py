@@ -15,6 +15,12 @@ logger = logging.getLogger('command')
 logger.addHandler(fh)
 logger.setLevel(logging.DEBUG)
 
+# default file port is command port + offset; offset is large, so several
+# holofans on consecutive command ports (6060, 6061, ...) never collide
+FILE_PORT_OFFSET = 1000
+# size of command response: `35a4` and parameters (see `Command.get_response`)
+RESPONSE_SIZE = 4
+
 
 class Command():
     """Constructor for composing packets for various holofan commands.
@@ -117,6 +123,23 @@ class Command():
                 break
         return op_name
 
+    @staticmethod
+    def get_response(request: bytes) -> bytes:
+        """Returns response expected from holofan for request.
+
+        Response repeats parameters of request (see `Command.get_data`).
+
+        Args:
+            request (bytes): raw request data
+
+        Returns:
+            bytes: raw response data
+        """
+        response = Command()
+        response.parameters = int(binascii.hexlify(request[4:6]), 16)
+        response.is_request = False
+        return response.get_data()
+
     def fan_on(self, is_request: bool = True) -> "Command":
         self.op_code = Command.get_op_code('fan_on')
         self.is_request = is_request
@@ -213,7 +236,7 @@ class Command():
     def inner_diameter(self,
                        parameters: int,
                        is_request: bool = True) -> "Command":
-        self.op_code = Command.get_op_code('set_angle')
+        self.op_code = Command.get_op_code('inner_diameter')
         if not 0 <= parameters <= 255:
             raise ValueError('Inner diameter value must be between 0 and 255')
         self.parameters = parameters
@@ -228,7 +251,7 @@ class Command():
     def change_playlist(self,
                         parameters: int,
                         is_request: bool = True) -> "Command":
-        self.op_code = Command.get_op_code('select_in_playlist')
+        self.op_code = Command.get_op_code('change_playlist')
         if not parameters >= 0:
             raise ValueError('Playlist # must be more than 0')
         self.parameters = parameters
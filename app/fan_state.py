@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+from typing import Callable
+from command import Command
+
+
+# creating log file
+log_file = os.path.join('..', 'fan_state.log')
+if not os.path.isfile(log_file) or \
+        os.path.getsize(log_file) > 5120:
+    open(log_file, 'w').close()
+fh = logging.FileHandler(log_file, mode="a")
+ftm = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+fh.setFormatter(ftm)
+logger = logging.getLogger('fan_state')
+logger.addHandler(fh)
+logger.setLevel(logging.DEBUG)
+
+
+class FanState():
+    """Last acknowledged settings of a single holofan.
+
+    Only commands that set an absolute value are tracked, so sending the
+    same one twice changes nothing on the fan.
+    """
+    # op name -> name of setting it changes
+    settings = {
+        'fan_on': 'power',
+        'fan_off': 'power',
+        'set_brightness': 'brightness',
+        'set_angle': 'angle',
+        'offset_x': 'offset',
+        'set_mask': 'mask',
+        'set_bg_color': 'bg_color',
+        'inner_diameter': 'inner_diameter',
+        'set_play_interval': 'interval',
+        'set_rotation_speed': 'speed',
+    }
+
+    def __init__(self):
+        """Creates empty state: every setting is unknown."""
+        self.state = {}
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        """Returns string representation of class.
+
+        Usage:
+            str(fan_state)
+            f'{fan_state}'
+        """
+        with self._lock:
+            return ', '.join(f'{key}: {value}'
+                             for key, value in self.state.items())
+
+    @staticmethod
+    def get_setting(command: Command) -> str | None:
+        """Returns name of setting changed by command.
+
+        Args:
+            command (Command): initiated command
+
+        Returns:
+            str|None: setting name, None if command is not tracked
+        """
+        return FanState.settings.get(Command.describe(command.op_code), None)
+
+    @staticmethod
+    def get_value(command: Command) -> int:
+        """Returns value of setting after command.
+
+        Args:
+            command (Command): initiated command
+
+        Returns:
+            int: op code for `power` setting, parameters for others
+        """
+        if FanState.get_setting(command) == 'power':
+            return command.op_code
+        return command.parameters
+
+    def is_redundant(self, command: Command) -> bool:
+        """Checks if fan already has setting value of command.
+
+        Args:
+            command (Command): initiated command
+
+        Returns:
+            bool: True if sending command would change nothing
+        """
+        setting = FanState.get_setting(command)
+        if setting is None:
+            return False
+        with self._lock:
+            return self.state.get(setting, None) == FanState.get_value(command)
+
+    def get_probe(self) -> Command | None:
+        """Returns command that sets one of known settings again.
+
+        Such command changes nothing on fan, so it is used as heartbeat.
+
+        Returns:
+            Command|None: command, None if no setting is known
+        """
+        with self._lock:
+            if not self.state:
+                return None
+            setting, value = next(iter(self.state.items()))
+        command = Command()
+        command.is_request = True
+        if setting == 'power':
+            command.op_code = value
+        else:
+            command.op_code = Command.get_op_code(next(
+                op_name for op_name, name in FanState.settings.items()
+                if name == setting
+            ))
+            command.parameters = value
+        return command
+
+    def forget(self, command: Command):
+        """Marks setting of command as unknown.
+
+        Used if command was not acknowledged: fan may have applied it
+        or not, so the setting must be neither skipped nor probed.
+
+        Args:
+            command (Command): sent command
+        """
+        with self._lock:
+            if command.op_code == Command.get_op_code('reset_settings'):
+                self.state.clear()
+                return
+            setting = FanState.get_setting(command)
+            if setting is not None:
+                self.state.pop(setting, None)
+
+    def acknowledge(self, command: Command):
+        """Updates state after command was acknowledged by fan.
+
+        Args:
+            command (Command): sent command
+        """
+        with self._lock:
+            if command.op_code == Command.get_op_code('reset_settings'):
+                self.state.clear()
+                return
+            setting = FanState.get_setting(command)
+            if setting is not None:
+                self.state[setting] = FanState.get_value(command)
+
+
+class Coalescer():
+    def __init__(self,
+                 send: Callable[[Command], None],
+                 window: float = 0.1) -> None:
+        """Merges bursts of commands changing the same setting.
+
+        Setting commands are delayed for `window` seconds; if another
+        command for the same setting arrives meanwhile, only the latest one
+        is sent. Other commands are sent at once, after pending ones, so
+        order of different operations is kept.
+
+        Args:
+            send (Callable[[Command], None]): function sending single command
+            window (float): delay of setting commands in seconds.
+                If 0, commands are sent without delay.
+        """
+        if window < 0:
+            raise ValueError('Coalescing window must not be negative')
+        self.send = send
+        self.window = window
+        self._pending = {}  # setting name -> latest command
+        self._timer = None
+        self._lock = threading.Lock()
+        # held while commands are taken and sent, so timer thread and
+        # caller never send out of order (reentrant: `submit` calls `flush`)
+        self._send_lock = threading.RLock()
+
+    def submit(self, command: Command):
+        """Sends command, possibly merged with following ones.
+
+        Args:
+            command (Command): initiated command
+        """
+        setting = FanState.get_setting(command)
+        if setting is None or self.window == 0:
+            with self._send_lock:
+                self.flush()
+                self.send(command)
+            return
+
+        with self._lock:
+            if setting in self._pending:
+                logger.debug(f'Command `{self._pending[setting]}` '
+                             f'replaced with `{command}`')
+            self._pending[setting] = command
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Sends all pending commands at once."""
+        with self._send_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                pending = list(self._pending.values())
+                self._pending.clear()
+            for command in pending:
+                self.send(command)
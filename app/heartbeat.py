@@ -0,0 +1,182 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+
+# creating log file
+log_file = os.path.join('..', 'heartbeat.log')
+if not os.path.isfile(log_file) or \
+        os.path.getsize(log_file) > 5120:
+    open(log_file, 'w').close()
+fh = logging.FileHandler(log_file, mode="a")
+ftm = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+fh.setFormatter(ftm)
+logger = logging.getLogger('heartbeat')
+logger.addHandler(fh)
+logger.setLevel(logging.DEBUG)
+
+
+def enable_keepalive(sock: socket.socket, idle: float = 5.0):
+    """Enables TCP keepalive, so OS detects dead peer of idle socket.
+
+    Args:
+        sock (socket.socket): connected socket
+        idle (float): time without traffic before first probe (s)
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    idle_ms = max(1000, int(idle * 1000))
+    if hasattr(socket, 'SIO_KEEPALIVE_VALS'):  # dos-like
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle_ms, 1000))
+        return
+    # unix-like (options differ between systems)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,
+                        idle_ms // 1000)
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 1)
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+
+class Heartbeat():
+    """Background liveness monitor of holofans.
+
+    Statuses:
+        unknown: no response yet and nothing to probe with
+        alive: fan responds in time
+        degraded: fan responds slowly or missed a heartbeat
+        dead: no response for `dead_after` seconds or connection is broken
+
+    Idle time alone never changes status: if there is nothing to probe
+    with, last status is kept until connection breaks.
+    """
+    def __init__(self,
+                 servers: list,
+                 interval: float = 1.0,
+                 dead_after: float = 3.0) -> None:
+        """Creates monitor of connected servers, one per holofan.
+
+        Every server is watched by own thread, so a dead fan never delays
+        others. Any response to regular command counts as heartbeat; if
+        there was none for `interval`, last acknowledged setting is sent
+        again (see `Server.probe`), which changes nothing on fan, but
+        reverts changes made bypassing the server (remote, vendor app).
+
+        Args:
+            servers (list[Server]): connected servers
+                (see `start_server.Server`)
+            interval (float): time between heartbeats (s)
+            dead_after (float): time without response after which fan is
+                marked as dead (s)
+        """
+        if interval <= 0:
+            raise ValueError('Heartbeat interval must be more than 0')
+        if dead_after < interval:
+            raise ValueError('Dead timeout must not be less than interval')
+        self.servers = servers
+        self.interval = interval
+        self.dead_after = dead_after
+        self.statuses = ['unknown'] * len(servers)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def __str__(self):
+        """Returns status table of all holofans.
+
+        Usage:
+            str(heartbeat)
+            f'{heartbeat}'
+        """
+        lines = [f'{"#":<4}{"port":<8}{"status":<10}{"RTT, ms":>10}'
+                 f'{"seen, s":>10}']
+        for idx, row in enumerate(self.get_table()):
+            rtt = '-' if row['rtt'] is None else f'{row["rtt"] * 1000:.2f}'
+            seen = '-' if row['seen'] is None else f'{row["seen"]:.1f}'
+            lines.append(f'{idx:<4}{row["port"]:<8}{row["status"]:<10}'
+                         f'{rtt:>10}{seen:>10}')
+        return '\n'.join(lines)
+
+    def get_status(self, server) -> str:
+        """Returns status of holofan of server.
+
+        Args:
+            server (Server): watched server (see `start_server.Server`)
+
+        Returns:
+            str: status (see `Heartbeat`)
+        """
+        return self.statuses[self.servers.index(server)]
+
+    def get_table(self) -> list[dict]:
+        """Returns live status of every holofan.
+
+        Returns:
+            list[dict]: `port`, `status`, last `rtt` (s) and time since
+                last response `seen` (s), in order of servers
+        """
+        now = time.perf_counter()
+        return [{
+            'port': server.server_port,
+            'status': self.statuses[idx],
+            'rtt': server.rtt,
+            'seen': None if server.last_seen is None
+            else now - server.last_seen,
+        } for idx, server in enumerate(self.servers)]
+
+    def start(self):
+        """Starts watching threads."""
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._watch, args=(idx, server),
+                             daemon=True)
+            for idx, server in enumerate(self.servers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f'Heartbeat started for {len(self.servers)} fans')
+
+    def stop(self):
+        """Stops watching threads."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        logger.info('Heartbeat stopped')
+
+    def _set_status(self, idx: int, status: str):
+        """Changes status of holofan, logging changes only."""
+        if self.statuses[idx] != status:
+            logger.warning(f'Fan {idx}: {self.statuses[idx]} -> {status}')
+            self.statuses[idx] = status
+
+    def _watch(self, idx: int, server):
+        """Sends heartbeats to single holofan until stopped."""
+        while not self._stop.wait(self.interval):
+            last_seen = server.last_seen
+            if last_seen is not None and \
+                    time.perf_counter() - last_seen < self.interval:
+                # regular traffic was answered recently, no probe needed
+                self._set_status(idx, server.get_health())
+                continue
+
+            try:
+                latency = server.probe()
+            except TimeoutError:
+                logger.debug(f'Fan {idx}: heartbeat missed')
+                self._set_status(idx, self._get_idle_status(server))
+            except OSError as msg:
+                logger.error(f'Fan {idx}: {msg}')
+                self._set_status(idx, 'dead')
+            else:
+                if latency is not None or server.last_seen != last_seen:
+                    # probe or regular command was answered meanwhile
+                    self._set_status(idx, server.get_health())
+                # otherwise nothing safe to send, last status is kept
+
+    def _get_idle_status(self, server) -> str:
+        """Returns status of holofan that did not respond recently."""
+        if server.last_seen is None or \
+                time.perf_counter() - server.last_seen > self.dead_after:
+            return 'dead'
+        return 'degraded'
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+
+# creating log file
+log_file = os.path.join('..', 'media_store.log')
+if not os.path.isfile(log_file) or \
+        os.path.getsize(log_file) > 5120:
+    open(log_file, 'w').close()
+fh = logging.FileHandler(log_file, mode="a")
+ftm = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+fh.setFormatter(ftm)
+logger = logging.getLogger('media_store')
+logger.addHandler(fh)
+logger.setLevel(logging.DEBUG)
+
+
+class MediaStore():
+    def __init__(self,
+                 root: str = os.path.join('..', 'media', 'store'),
+                 budget: int = 2**30) -> None:
+        """Content-addressed storage of received video files.
+
+        Files are saved as blobs named by sha256 of their content, so the
+        same clip sent under different names is stored once. Index file
+        maps file names to blobs and keeps last play time of every blob,
+        which is used to evict least recently played blobs when total size
+        exceeds budget.
+
+        Args:
+            root (str): storage folder. Defaults to `../media/store`.
+            budget (int): max total size of blobs in bytes. Defaults to 1 GiB.
+        """
+        if budget <= 0:
+            raise ValueError('Storage budget must be more than 0')
+        self.root = root
+        self.budget = budget
+        self.index_path = os.path.join(self.root, 'index.json')
+        os.makedirs(os.path.join(self.root, 'blobs'), exist_ok=True)
+
+        # names: {file name: blob digest}
+        # blobs: {blob digest: {'ext': str, 'size': int, 'played': float}}
+        self.names = {}
+        self.blobs = {}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r') as file:
+                index = json.load(file)
+            self.names = index['names']
+            self.blobs = index['blobs']
+        logger.info(f'{len(self.names)} names, {len(self.blobs)} blobs, '
+                    f'{self.get_size()} bytes in store')
+
+    def __str__(self):
+        """Returns string representation of class.
+
+        Usage:
+            str(store)
+            f'{store}'
+        """
+        return (f'{len(self.names)} files, {len(self.blobs)} blobs, '
+                f'{self.get_size() / 2**20:.2f} / '
+                f'{self.budget / 2**20:.2f} MiB')
+
+    def get_size(self) -> int:
+        """Returns total size of all blobs in bytes."""
+        return sum(blob['size'] for blob in self.blobs.values())
+
+    def blob_path(self, digest: str) -> str:
+        """Returns path to blob file.
+
+        Args:
+            digest (str): sha256 hex digest of blob content
+
+        Returns:
+            str: path to blob file
+        """
+        return os.path.join(self.root, 'blobs',
+                            digest + self.blobs[digest]['ext'])
+
+    def save_index(self):
+        """Writes index to `self.index_path` atomically."""
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'names': self.names, 'blobs': self.blobs}, file)
+        os.replace(tmp_path, self.index_path)
+
+    def put(self, name: str, data: bytes) -> str:
+        """Saves file content under given name.
+
+        If blob with the same content already exists, only name is added.
+
+        Args:
+            name (str): file name, as received from server
+            data (bytes): file content
+
+        Returns:
+            str: path to blob file
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in self.blobs:
+            logger.info(f'File `{name}` is already stored as {digest[:12]}')
+            self.blobs[digest]['played'] = time.time()
+        else:
+            self.blobs[digest] = {
+                'ext': os.path.splitext(name)[1],
+                'size': len(data),
+                'played': time.time(),
+            }
+            path = self.blob_path(digest)
+            with open(path + '.tmp', 'wb') as file:
+                file.write(data)
+            os.replace(path + '.tmp', path)
+            logger.info(f'File `{name}` stored as {digest[:12]}')
+        old_digest = self.names.get(name, None)
+        self.names[name] = digest
+        # name was reused for new content, drop old blob if unreferenced
+        if old_digest not in (None, digest) and \
+                old_digest not in self.names.values():
+            self.remove_blob(old_digest)
+
+        self.evict(keep=digest)
+        self.save_index()
+        return self.blob_path(digest)
+
+    def get(self, name: str) -> str | None:
+        """Returns path to stored file.
+
+        Args:
+            name (str): file name
+
+        Returns:
+            str|None: path to blob file, None if file is not stored
+        """
+        digest = self.names.get(name, None)
+        if digest is None:
+            return None
+        return self.blob_path(digest)
+
+    def touch(self, name: str):
+        """Marks file as played now, so it is evicted last.
+
+        Args:
+            name (str): file name
+        """
+        digest = self.names.get(name, None)
+        if digest is None:
+            return
+        self.blobs[digest]['played'] = time.time()
+        self.save_index()
+
+    def evict(self, keep: str | None = None):
+        """Removes least recently played blobs until store fits budget.
+
+        Args:
+            keep (str, optional): digest of blob that must not be removed
+                (eg. just received one)
+        """
+        size = self.get_size()
+        for digest in sorted(self.blobs,
+                             key=lambda d: self.blobs[d]['played']):
+            if size <= self.budget:
+                break
+            if digest == keep:
+                continue
+
+            size -= self.blobs[digest]['size']
+            self.remove_blob(digest)
+
+    def remove_blob(self, digest: str):
+        """Removes blob file and all names pointing to it.
+
+        Args:
+            digest (str): sha256 hex digest of blob content
+        """
+        path = self.blob_path(digest)
+        if os.path.isfile(path):
+            os.remove(path)
+        del self.blobs[digest]
+        for name in [n for n, d in self.names.items() if d == digest]:
+            del self.names[name]
+            logger.info(f'File `{name}` was removed')
+        logger.debug(f'Blob {digest[:12]} was removed')
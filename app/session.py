@@ -0,0 +1,280 @@
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from argparse import ArgumentParser, ArgumentTypeError
+from command import Command
+
+
+# creating log file
+log_file = os.path.join('..', 'session.log')
+if not os.path.isfile(log_file) or \
+        os.path.getsize(log_file) > 5120:
+    open(log_file, 'w').close()
+fh = logging.FileHandler(log_file, mode="a")
+ftm = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+fh.setFormatter(ftm)
+logger = logging.getLogger('session')
+logger.addHandler(fh)
+logger.setLevel(logging.DEBUG)
+
+MAGIC = b'HFS1'
+# time since session start (s), kind, total size (bytes), latency (s),
+# payload length; followed by payload
+RECORD = struct.Struct('<dBIfH')
+COMMAND = 0
+FILE = 1
+
+
+class SessionRecorder():
+    def __init__(self, path: str) -> None:
+        """Writes command and file traffic of server session to binary log.
+
+        Commands are saved with their raw data. Files are saved with upload
+        header (size and name) only, content is not kept.
+
+        Args:
+            path (str): log file path
+        """
+        self.path = path
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC)
+        self._start = time.perf_counter()
+        # commands and files are recorded from different threads
+        self._lock = threading.Lock()
+        logger.info(f'Recording session to {self.path}')
+
+    def _write(self, kind: int, size: int, latency: float, payload: bytes):
+        """Appends single record to log."""
+        with self._lock:
+            self._file.write(RECORD.pack(time.perf_counter() - self._start,
+                                         kind, size, latency, len(payload)))
+            self._file.write(payload)
+            self._file.flush()
+
+    def record_command(self, data: bytes, latency: float):
+        """Saves sent command.
+
+        Args:
+            data (bytes): raw command data (see `Command.get_data`)
+            latency (float): time until response was received (s)
+        """
+        self._write(COMMAND, len(data), latency, data)
+
+    def record_file(self, data: bytes, latency: float):
+        """Saves sent video file.
+
+        Args:
+            data (bytes): raw file data with header (see `Video.get_data`)
+            latency (float): time of upload until response was received (s)
+        """
+        name_len = data[15]
+        self._write(FILE, len(data), latency, data[:16+name_len])
+
+    def close(self):
+        """Closes log file."""
+        self._file.close()
+        logger.info(f'Session saved to {self.path}')
+
+
+class SessionReplayer():
+    def __init__(self, path: str) -> None:
+        """Reads binary log written by `SessionRecorder`.
+
+        Args:
+            path (str): log file path
+
+        Raises:
+            ValueError: file is not a session log
+        """
+        self.path = path
+        # list of (time, kind, size, latency, payload)
+        self.records = []
+        with open(self.path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{self.path} is not a session log')
+            while header := file.read(RECORD.size):
+                *fields, payload_len = RECORD.unpack(header)
+                self.records.append((*fields, file.read(payload_len)))
+        logger.info(f'{len(self.records)} records loaded from {self.path}')
+
+    @staticmethod
+    def get_data(kind: int, size: int, payload: bytes) -> bytes:
+        """Rebuilds data to send from record.
+
+        Missing content of files is replaced with zero bytes.
+        """
+        if kind == FILE:
+            return payload + bytes(size - len(payload))
+        return payload
+
+    def replay(self, server, fast: bool = False) -> dict:
+        """Sends recorded traffic again and measures it.
+
+        Args:
+            server (Server): connected server (see `start_server.Server`)
+            fast (bool): if True, records are sent without pauses,
+                otherwise with original timing
+
+        Returns:
+            dict: stats of replay (see `SessionReplayer.get_stats`)
+        """
+        results = []
+        start = time.perf_counter()
+
+        def send(kind, size, payload):
+            try:
+                latency = server.transmit(
+                    SessionReplayer.get_data(kind, size, payload),
+                    is_file=kind == FILE
+                )
+            except TimeoutError:
+                # counted in stats, replay goes on
+                latency = None
+                logger.warning(f'{Command.describe(payload[3])}: timed out')
+            results.append((time.perf_counter() - start,
+                            kind, size, latency, payload))
+            if kind == COMMAND and latency is not None:
+                logger.debug(f'{Command.describe(payload[3])}: '
+                             f'{latency * 1000:.2f} ms')
+
+        # records are saved at the end of transmission, so they are
+        # scheduled by time of beginning
+        uploads = []
+        for rec_time, kind, size, latency, payload in sorted(
+                self.records, key=lambda rec: rec[0] - rec[3]):
+            if not fast:
+                delay = rec_time - latency - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if kind == FILE:
+                # files use separate socket, commands go on meanwhile
+                upload = threading.Thread(target=send,
+                                          args=(kind, size, payload))
+                upload.start()
+                uploads.append(upload)
+            else:
+                send(kind, size, payload)
+        for upload in uploads:
+            upload.join()
+        return SessionReplayer.get_stats(
+            sorted(results, key=lambda rec: rec[0]))
+
+    @staticmethod
+    def get_stats(records: list) -> dict:
+        """Calculates latency and throughput of records.
+
+        Args:
+            records (list): list of (time, kind, size, latency, payload),
+                latency is None for timed out commands
+
+        Returns:
+            dict: duration (s), commands count, timed out commands count,
+                mean and p95 command latency (ms), mean latency of commands
+                sent during file upload (ms), files count, file throughput
+                (bytes/s)
+        """
+        answered = [rec for rec in records if rec[3] is not None]
+        latencies = sorted(rec[3] * 1000 for rec in answered
+                           if rec[1] == COMMAND)
+        files = [rec for rec in answered if rec[1] == FILE]
+        upload_time = sum(rec[3] for rec in files)
+        # (begin, end) of every upload
+        uploading = [(rec[0] - rec[3], rec[0]) for rec in files]
+        busy_latencies = [
+            rec[3] * 1000 for rec in answered
+            if rec[1] == COMMAND and any(
+                begin < rec[0] and rec[0] - rec[3] < end
+                for begin, end in uploading
+            )
+        ]
+        stats = {
+            'duration': records[-1][0] if records else 0.0,
+            'commands': len(latencies),
+            'timeouts': len(records) - len(answered),
+            'latency_mean': 0.0,
+            'latency_p95': 0.0,
+            'latency_upload': 0.0,
+            'files': len(files),
+            'throughput': 0.0,
+        }
+        if latencies:
+            stats['latency_mean'] = sum(latencies) / len(latencies)
+            p95_idx = round(0.95 * (len(latencies) - 1))
+            stats['latency_p95'] = latencies[p95_idx]
+        if busy_latencies:
+            stats['latency_upload'] = \
+                sum(busy_latencies) / len(busy_latencies)
+        if upload_time > 0:
+            stats['throughput'] = sum(rec[2] for rec in files) / upload_time
+        return stats
+
+    @staticmethod
+    def compare(recorded: dict, replayed: dict) -> str:
+        """Returns table of recorded and replayed stats.
+
+        Args:
+            recorded (dict): stats of recorded session
+            replayed (dict): stats of replay
+
+        Returns:
+            str: table with columns: stat, recorded, replayed, difference
+        """
+        lines = [f'{"":<16}{"recorded":>16}{"replayed":>16}{"diff":>10}']
+        for key, value in recorded.items():
+            diff = '-'
+            if value:
+                diff = f'{(replayed[key] - value) / value:+.1%}'
+            lines.append(f'{key:<16}{value:>16.2f}'
+                         f'{replayed[key]:>16.2f}{diff:>10}')
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    """Replays recorded session.
+
+    This section parses command-line arguments, waits for holofan (or
+    `start_client.py` emulator) connection and replays session log.
+
+    Args/Vars:
+        path (str): session log file path (see `start_server.py --record`)
+        client_ip (str): Used to limit client's IP address for connection.
+        client_port (int): Port number in range [1024, 65535] for commands
+        file_port (int): Port number in range [1024, 65535] for files.
+            Default `client_port + 1000`
+        buff_size (int): Max data size in packet. Default (1460) as in DSEE-65H
+        fast (bool): Replay as fast as possible instead of original timing
+    """
+    from command import FILE_PORT_OFFSET
+    from start_server import Server
+
+    # parsing command line args
+    parser = ArgumentParser()
+    parser.add_argument('path', type=str)
+    parser.add_argument('-i', '--ipaddr', type=str, default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=6060)
+    parser.add_argument('-f', '--file-port', type=int, default=None)
+    parser.add_argument('-b', '--buff', type=int, default=1460)
+    parser.add_argument('--fast', action='store_true')
+    params = parser.parse_args(sys.argv[1:])
+
+    if not 1024 <= params.port <= 65535:
+        raise ArgumentTypeError('Invalid port number')
+        quit(2)
+    file_port = params.file_port or params.port + FILE_PORT_OFFSET
+    if not 1024 <= file_port <= 65535 or file_port == params.port:
+        raise ArgumentTypeError('Invalid file port number')
+        quit(2)
+    if not 1024 <= params.buff <= 1600:
+        raise ArgumentTypeError('Invalid buff size number')
+        quit(2)
+
+    replayer = SessionReplayer(params.path)
+    server = Server(params.ipaddr, params.port, params.buff,
+                    file_port=file_port)
+    server.create_connection()
+    replayed = replayer.replay(server, params.fast)
+    print(SessionReplayer.compare(
+        SessionReplayer.get_stats(replayer.records), replayed))
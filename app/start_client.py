@@ -8,10 +8,13 @@ except ImportError:
 import binascii
 import socket
 import sys
+import threading
 import os
 from argparse import ArgumentParser, ArgumentTypeError
 import logging
-from command import Command
+from command import FILE_PORT_OFFSET, Command
+from media_store import MediaStore
+from heartbeat import enable_keepalive
 
 
 # creating log file
@@ -31,53 +34,93 @@ class Client:
     def __init__(self,
                  server_ip: str,
                  client_port: int,
-                 buff_size: int) -> None:
+                 buff_size: int,
+                 store: MediaStore,
+                 file_port: int | None = None) -> None:
         """Creates instance of client
 
         Args:
             server_ip (str): Server's IP address for connection.
             client_port (int): Port number in range [1024, 65535]
+                for commands
             buff_size (int): Max data size in packet.
                 Default (1460) as in DSEE-65H
+            store (MediaStore): storage for received video files
+            file_port (int, optional): Port number in range [1024, 65535]
+                for files. Defaults to `client_port + FILE_PORT_OFFSET`.
         """
         self.server_ip = server_ip
         self.client_port = client_port
+        self.file_port = file_port or client_port + FILE_PORT_OFFSET
         self.buff_size = buff_size
+        self.store = store
 
-        self.is_binary_mode = False
+    def _connect(self, port: int) -> socket.socket:
+        """Connects to server port.
 
-    def create_connection(self):
-        """Creates socket connection.
+        Args:
+            port (int): Port number in range [1024, 65535]
 
-        Creates a value:
-                self.client_socket (socket.socket): client's instance
-                self.client_socket (socket.socket): Client's instance
+        Returns:
+            socket.socket: connected socket
         """
         try:
             # socket.AF_INET = IPv4; socket.SOCK_STREAM = TCP
             server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server_socket.connect((self.server_ip, self.client_port))
+            server_socket.connect((self.server_ip, port))
         except ConnectionRefusedError as msg:
             logger.error(f'Unable to connect to server: {msg}')
             quit(2)
         else:
-            logger.info(f'Client connected to server {self.server_ip}')
-            # server_socket.settimeout(0.2)
-            self.server_socket = server_socket
+            logger.info(f'Client connected to server {self.server_ip}:{port}')
+            return server_socket
+
+    def create_connection(self):
+        """Creates socket connections.
+
+        Holofan uses 2 different ports for commands and files, so commands
+        are received while file is uploading. Creates values:
+                self.comm_socket (socket.socket): socket for commands
+                self.file_socket (socket.socket): socket for files
+        """
+        self.comm_socket = self._connect(self.client_port)
+        self.file_socket = self._connect(self.file_port)
+        # server may be silent for long, OS detects if it is gone
+        enable_keepalive(self.comm_socket)
+        enable_keepalive(self.file_socket)
+
+    def _recv_exact(self, size: int) -> bytes:
+        """Receive exactly `size` bytes from file socket.
+
+        Raises:
+            ConnectionError: server closed connection
+        """
+        data = bytearray()
+        while len(data) < size:
+            received = self.file_socket.recv(
+                min(self.buff_size, size - len(data)))
+            if not received:
+                raise ConnectionError('Server closed connection')
+            data += received
+        return bytes(data)
 
     def menu(self):
-        """Receive packet and check type (command or file)"""
-        received = self.server_socket.recv(self.buff_size).hex()
+        """Receive command packet and respond to it"""
+        received = self.comm_socket.recv(self.buff_size).hex()
+        if not received:
+            raise ConnectionError('Server closed connection')
         logger.debug(f'Received {received[:12]}')
         if received.startswith('05'):  # commands
             self.receive(received)
-        elif received == '01':  # files
-            self.is_binary_mode = True
-            # receive file
-            received = self.server_socket.recv(self.buff_size)
-            self.receive_file(received)
-            self.is_binary_mode = False
+
+    def serve_commands(self):
+        """Receive commands until connection is closed"""
+        try:
+            while True:
+                self.menu()
+        except OSError as msg:  # incl. ConnectionError, keepalive timeout
+            logger.info(f'Command connection closed: {msg}')
 
     def receive(self, received: str):
         """Parse received command"""
@@ -86,35 +129,32 @@ class Client:
         print(f'Received command: {op_name}')
         logger.info(f'Received command: {op_name}')
 
-        # call function by str name
-        response = getattr(Command(), op_name)(is_request=False)
-        self.server_socket.send(response.get_data())  # file received
+        # response repeats parameters of request
+        response = Command()
+        response.op_code = op_code
+        response.parameters = int(received[8:12], 16)
+        response.is_request = False
+        self.comm_socket.send(response.get_data())
         logger.debug('Response has been sent')
 
-    def receive_file(self, received: str):
+    def receive_file(self):
         """Receive and parse video file"""
-        data = b''
-        file_size = int(binascii.hexlify(received[:10]), 16)
-        name_len = int(binascii.hexlify(received[14:16]), 16)
-        file_path = os.path.join('..', 'media', 'tmp',
-                                 received[16:16+name_len].decode('utf-8'))
-        logger.debug(f'Received {received[:16+name_len]}')
-
-        data += received
-        while len(data) < file_size:
-            received = self.server_socket.recv(self.buff_size)
-            if len(data) >= file_size:
-                logger.info('File has been received')
-                break
-            data += received
+        header = self._recv_exact(16)
+        file_size = int(binascii.hexlify(header[:10]), 16)
+        name_len = int(binascii.hexlify(header[14:16]), 16)
+        file_name = self._recv_exact(name_len).decode('utf-8')
+        logger.debug(f'Received {header + file_name.encode("utf-8")}')
+
+        data = self._recv_exact(file_size)
+        logger.info('File has been received')
 
-        # Send `change binary mode` status (b'01')
-        self.server_socket.send(b'\x01')
+        # Send `file received` status (b'01')
+        self.file_socket.send(b'\x01')
 
-        with open(file_path, 'wb') as file:
-            file.write(data[16+name_len:])
-            logger.info('File was written')
+        file_path = self.store.put(file_name, data)
+        logger.info(f'File was written, store: {self.store}')
 
+        self.store.touch(file_name)
         self.play(file_path)
 
     def play(self, file_path):
@@ -161,14 +201,19 @@ if __name__ == '__main__':
 
     Args/Vars:
         client_ip (str): client's IP address for connection.
-        client_port (int): Port number in range [1024, 65535]
+        client_port (int): Port number in range [1024, 65535] for commands
+        file_port (int): Port number in range [1024, 65535] for files.
+            Default `client_port + 1000`
         buff_size (int): Max data size in packet. Default (1460) as in DSEE-65H
+        storage (int): Max size of stored video files in MiB. Default 1024.
     """
     # parsing of command-line args
     parser = ArgumentParser()
     parser.add_argument('-i', '--ipaddr', default='localhost')
     parser.add_argument('-p', '--port', type=int, default=6060)
+    parser.add_argument('-f', '--file-port', type=int, default=None)
     parser.add_argument('-b', '--buff', type=int, default=1460)
+    parser.add_argument('-s', '--storage', type=int, default=1024)
     params = parser.parse_args(sys.argv[1:])
 
     # assigning all parameters
@@ -179,12 +224,24 @@ if __name__ == '__main__':
         raise ArgumentTypeError('Invalid port number')
         quit(2)
 
+    file_port = params.file_port or server_port + FILE_PORT_OFFSET
+    if not 1024 <= file_port <= 65535 or file_port == server_port:
+        raise ArgumentTypeError('Invalid file port number')
+        quit(2)
+
     buff_size = params.buff
     if not 1024 <= buff_size <= 1600:
         raise ArgumentTypeError('Invalid buff size number')
         quit(2)
 
-    client = Client(server_ip, server_port, buff_size)
+    if not params.storage > 0:
+        raise ArgumentTypeError('Invalid storage size')
+        quit(2)
+    store = MediaStore(budget=params.storage * 2**20)
+
+    client = Client(server_ip, server_port, buff_size, store, file_port)
     client.create_connection()
+    # commands are served in background, files (and playback) in main thread
+    threading.Thread(target=client.serve_commands, daemon=True).start()
     while True:
-        client.receive()
+        client.receive_file()
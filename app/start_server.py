@@ -1,10 +1,17 @@
+import select
 import socket
 import sys
+import threading
+import time
 import os
 from argparse import ArgumentParser, ArgumentTypeError
 import logging
 from video import Video
-from command import Command
+from autotune import Autotuner
+from fan_state import Coalescer, FanState
+from session import SessionRecorder
+from heartbeat import Heartbeat, enable_keepalive
+from command import FILE_PORT_OFFSET, RESPONSE_SIZE, Command
 
 
 # creating log file
@@ -24,28 +31,68 @@ class Server:
     def __init__(self,
                  client_ip: str,
                  server_port: int,
-                 buff_size: int) -> None:
+                 buff_size: int,
+                 autotuner: Autotuner | None = None,
+                 window: float = 0.1,
+                 recorder: SessionRecorder | None = None,
+                 file_port: int | None = None,
+                 fan_fit: bool = False,
+                 timeout: float = 1.0) -> None:
         """Creates instance of server
 
         Args:
             client_ip (str): Used to limit client's IP address for connection.
                 If empty string, it uses all interfaces.
             client_port (int): Port number in range [1024, 65535]
+                for commands
             buff_size (int): Max data size in packet.
                 Default (1460) as in DSEE-65H
+            autotuner (Autotuner, optional): if given, encoder settings of
+                every video file are selected by VMAF before sending.
+            window (float): time in seconds, during which commands changing
+                the same setting are merged into the latest one.
+            recorder (SessionRecorder, optional): if given, all sent
+                commands and files are written to session log.
+            file_port (int, optional): Port number in range [1024, 65535]
+                for files. Defaults to `server_port + FILE_PORT_OFFSET`.
+            fan_fit (bool): if True, video files are cropped to holofan
+                display before encoding (see `Video.fan_fit`).
+            timeout (float): max time to wait for command response (s).
         """
         self.client_ip = client_ip
         self.server_port = server_port
+        self.file_port = file_port or server_port + FILE_PORT_OFFSET
         self.buff_size = buff_size
+        self.autotuner = autotuner
+        self.recorder = recorder
+        self.fan_fit = fan_fit
+        self.timeout = timeout
+
+        # liveness of fan, updated by every response
+        self.last_seen = None  # time.perf_counter() of last response
+        self.rtt = None  # round-trip time of last command (s)
+        self._late_responses = 0  # responses that came after timeout
+        # time.perf_counter() after which late responses are given up
+        self._late_deadline = 0.0
+        # set if fan is watched by `Heartbeat`, used to display status
+        self.heartbeat = None
+
+        # last acknowledged settings of fan, used to skip no-op commands
+        self.fan_state = FanState()
+        self.coalescer = Coalescer(self.send_command, window)
+        # only one request may wait for response on each socket
+        # (reentrant: commands hold it until fan state is updated)
+        self._comm_lock = threading.RLock()
+        self._file_lock = threading.Lock()
+
+    def _listen(self, port: int) -> socket.socket:
+        """Opens server socket on port.
 
-        self.is_binary_mode = False
-
-    def create_connection(self):
-        """Creates socket connection with client.
+        Args:
+            port (int): Port number in range [1024, 65535]
 
-        Creates a pair of values as tuple:
-                self.server_socket (socket.socket): Server's instance
-                self.client_socket (socket.socket): Client's instance
+        Returns:
+            socket.socket: Server's instance
         """
         # open socket
         try:
@@ -53,30 +100,94 @@ class Server:
             server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             # '' opens socket for everyone
-            server_socket.bind(('', self.server_port))
+            server_socket.bind(('', port))
+            server_socket.listen(1)
         except (socket.error, KeyboardInterrupt) as msg:
             logger.error(f'Unable to start server: {msg}')
             server_socket.close()
             quit(2)
         else:
-            logger.info(f'Server started on port {self.server_port}')
-            print(f'Server started on port {self.server_port}')
+            logger.info(f'Server started on port {port}')
+            print(f'Server started on port {port}')
+            return server_socket
+
+    def _accept(self, server_socket: socket.socket) -> socket.socket:
+        """Waits for 1 client on server socket.
+
+        Args:
+            server_socket (socket.socket): Server's instance
 
-        # wait for 1 client
+        Returns:
+            socket.socket: Client's instance
+        """
+        port = server_socket.getsockname()[1]
         try:
-            server_socket.listen(1)
             client_socket, _ = server_socket.accept()
         except (socket.error, KeyboardInterrupt) as msg:
             logger.error(f'Unable to connect client: {msg}')
-            client_socket.close()
             server_socket.close()
             quit(2)
         else:
-            logger.info(f'Client {self.client_ip} connected to server')
-            print(f'Client {self.client_ip} connected to server')
-            # server_socket.settimeout(0.2)
-            self.server_socket = server_socket
-            self.client_socket = client_socket
+            logger.info(f'Client {self.client_ip} connected to port {port}')
+            print(f'Client {self.client_ip} connected to port {port}')
+            return client_socket
+
+    def create_connection(self):
+        """Creates socket connections with client.
+
+        Holofan uses 2 different ports for commands and files, so file
+        uploads never block commands. Creates values:
+                self.comm_server_socket (socket.socket): Server's instance
+                    for commands
+                self.comm_socket (socket.socket): Client's instance
+                    for commands
+                self.file_server_socket (socket.socket): Server's instance
+                    for files
+                self.file_socket (socket.socket): Client's instance
+                    for files
+        """
+        # both ports are opened before client connects to any of them
+        self.listen()
+        self.accept()
+
+    def listen(self):
+        """Opens command and file ports (first half of `create_connection`).
+
+        Several servers must all listen before any of them accepts, as
+        clients may connect in any order.
+        """
+        self.comm_server_socket = self._listen(self.server_port)
+        self.file_server_socket = self._listen(self.file_port)
+
+    def accept(self):
+        """Waits for client on both ports opened by `listen`."""
+        self.comm_socket = self._accept(self.comm_server_socket)
+        self.file_socket = self._accept(self.file_server_socket)
+        # command response must come in time; upload stalls if fan reads
+        # nothing for the same time (see `transmit`)
+        self.comm_socket.settimeout(self.timeout)
+        self.file_socket.settimeout(self.timeout)
+        # vanished fan is found even if nothing is sent to it
+        enable_keepalive(self.comm_socket)
+        enable_keepalive(self.file_socket)
+
+    def close(self):
+        """Sends pending commands and closes all sockets."""
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+        self.coalescer.flush()
+        # upload in progress is interrupted, not waited for
+        for sock in (self.comm_socket, self.file_socket):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # already closed by fan
+        with self._file_lock:
+            if self.recorder is not None:
+                self.recorder.close()
+            for sock in (self.comm_socket, self.file_socket,
+                         self.comm_server_socket, self.file_server_socket):
+                sock.close()
 
     def menu(self):
         """Displays menu of commands to select.
@@ -104,13 +215,13 @@ class Server:
         print('\t16. Сменить плейлист')
         print('\t17. Изменить интервал между видео')
         print('\t18. Изменить скорость вентилятора')
+        print('\t19. Состояние холофанов')
 
         # input command number
         i = int(input('>>> '))
         match i:
             case 0:
-                self.server_socket.close()
-                self.client_socket.close()
+                self.close()
                 quit(0)
             case 1:
                 # if 1, send file
@@ -118,7 +229,9 @@ class Server:
                 file_path = os.path.join('..', 'media', file_name)
                 # print(os.path.abspath(file_path))
                 file = Video(os.path.abspath(file_path))
-                self.send_file(file)
+                # upload in background, commands can be sent meanwhile
+                threading.Thread(target=self.send_file, args=(file,),
+                                 daemon=True).start()
 
                 # end running `menu` method (go to next loop iteration)
                 return
@@ -185,6 +298,12 @@ class Server:
                 print('\t2 - быстрая')
                 p = int(input('>>> '))
                 command = Command().set_rotation_speed(p)
+            case 19:
+                if self.heartbeat is None:
+                    print('Мониторинг отключен')
+                else:
+                    print(self.heartbeat)
+                return
             case _:
                 return
 
@@ -192,7 +311,7 @@ class Server:
                      f'p: {p if "p" in locals() else "-"}')
 
         # command won't be send if `Выбрать видеофайл` was selected
-        self.send_command(command)
+        self.coalescer.submit(command)
 
     def send_command(self, request: Command):
         """Send command, which must be initiated firstly.
@@ -202,12 +321,82 @@ class Server:
         Args:
             request (Command): initiated command to send
         """
-        self.client_socket.send(request.get_data())
-        logger.info(f'Command `{request}` was sent')  # using Command.__str__()
+        # dead fan would block control loop for timeouts,
+        # its recovery is found by heartbeat
+        if self.heartbeat is not None and \
+                self.heartbeat.get_status(self) == 'dead':
+            print('Холофан недоступен, команда не отправлена')
+            logger.warning(f'Command `{request}` skipped, fan is dead')
+            return
+
+        # fan state must not change between check and update,
+        # otherwise heartbeat may send outdated setting (see `probe`)
+        with self._comm_lock:
+            if self.fan_state.is_redundant(request):
+                logger.info(f'Command `{request}` skipped, fan state: '
+                            f'{self.fan_state}')
+                return
 
-        # wait for response
-        response = self.client_socket.recv(self.buff_size)
-        logger.info('Response received')
+            try:
+                latency = self.transmit(request.get_data())
+            except TimeoutError:
+                print(f'Холофан не ответил за {self.timeout} с')
+                logger.warning(f'Command `{request}` timed out')
+                # fan may have applied it or not
+                self.fan_state.forget(request)
+                return
+            # using Command.__str__()
+            logger.info(f'Command `{request}` was sent, '
+                        f'response in {latency * 1000:.2f} ms')
+            self.fan_state.acknowledge(request)
+
+    def probe(self) -> float | None:
+        """Sends one of acknowledged settings again, used as heartbeat.
+
+        Probe is built and sent while no command is in progress, so it
+        always repeats current setting and changes nothing on fan.
+
+        If no setting is known, nothing is sent, only connection is checked
+        (see `_check_connection`). If fan has not answered previous command
+        yet, it is not asked again, so commands never wait behind probe
+        of unresponsive fan.
+
+        Raises:
+            TimeoutError: no response in `timeout` seconds, or previous
+                command is not answered yet
+            OSError: client closed connection or it is broken
+
+        Returns:
+            float|None: time until response was received (s),
+                None if no setting is known
+        """
+        with self._comm_lock:
+            if self._late_responses > 0:
+                self._drain_late_responses(RESPONSE_SIZE, wait=False)
+                if self._late_responses > 0:
+                    raise TimeoutError('Previous command is not answered')
+            probe = self.fan_state.get_probe()
+            if probe is None:
+                self._check_connection()
+                return None
+            return self.transmit(probe.get_data(), record=False)
+
+    def _check_connection(self):
+        """Checks idle command connection without sending anything.
+
+        Nothing is expected on idle socket, so if it is readable, fan
+        closed connection or it was broken (found by TCP keepalive).
+
+        Raises:
+            OSError: client closed connection or it is broken
+        """
+        if not self._is_readable():
+            return
+        # does not block: data, end of stream or error is ready
+        data = self.comm_socket.recv(self.buff_size)
+        if not data:
+            raise ConnectionError('Client closed connection')
+        logger.warning(f'Unexpected data {data.hex()} discarded')
 
     def send_file(self, file: Video):
         """Send video file, which must be initiated firstly.
@@ -217,28 +406,203 @@ class Server:
         Args:
             file (Video): initiated video file
         """
-        # Before sending file binary mode must be enabled
-        # After sending & receiving response binary mode must be disabled
-        self.is_binary_mode = True
-        # Send `change binary mode` status (b'01')
-        self.client_socket.send(b'\x01')
-        logger.debug('Enter binary mode')
+        file.encode_settings['fan_fit'] = self.fan_fit
+        if self.autotuner is not None:
+            self.autotuner.tune(file)
         data = file.get_data()
 
+        try:
+            latency = self.transmit(data, is_file=True)
+        except OSError as msg:
+            print(f'Файл `{file}` не был отправлен')
+            logger.error(f'File `{file}` was not sent: {msg}')
+            return
+        # using Video.__str__()
+        logger.info(f'File `{file}` was sent in {latency:.2f} s')
+
+    def get_health(self) -> str:
+        """Returns health of fan by last response.
+
+        Returns:
+            str: `alive` if last command RTT is below half of `timeout`,
+                `degraded` otherwise, `unknown` if there was no response
+        """
+        if self.last_seen is None:
+            return 'unknown'
+        if self.rtt is not None and self.rtt > self.timeout / 2:
+            return 'degraded'
+        return 'alive'
+
+    def _recv_response(self, size: int, timeout: float) -> bytes:
+        """Reads exactly `size` bytes of command response.
+
+        Args:
+            size (int): response size (bytes)
+            timeout (float): max time to wait for whole response (s)
+
+        Raises:
+            TimeoutError: response is not received in time
+            ConnectionError: client closed connection
+
+        Returns:
+            bytes: raw response data
+        """
+        deadline = time.perf_counter() + timeout
+        response = bytearray()
+        try:
+            while len(response) < size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise TimeoutError('Response timed out')
+                self.comm_socket.settimeout(remaining)
+                chunk = self.comm_socket.recv(size - len(response))
+                if not chunk:
+                    raise ConnectionError('Client closed connection')
+                response += chunk
+        finally:
+            self.comm_socket.settimeout(self.timeout)
+        return bytes(response)
+
+    def _is_readable(self) -> bool:
+        """Checks without blocking if command socket has data to read."""
+        readable, _, _ = select.select([self.comm_socket], [], [], 0)
+        return bool(readable)
+
+    def _drain_late_responses(self, size: int, wait: bool = True):
+        """Reads responses to timed out commands before next one is sent.
+
+        Late responses are waited for at most `timeout` after the last
+        command timed out; if they do not come in that time, they are
+        considered lost.
+
+        Args:
+            size (int): response size (bytes)
+            wait (bool): if False, only responses that have already come
+                are read
+        """
+        while self._late_responses > 0:
+            remaining = self._late_deadline - time.perf_counter()
+            if remaining <= 0:
+                logger.warning(f'{self._late_responses} late responses '
+                               f'were lost')
+                self._late_responses = 0
+                return
+            if not wait and not self._is_readable():
+                return
+            try:
+                response = self._recv_response(size, remaining)
+            except TimeoutError:
+                continue
+            logger.debug(f'Late response {response.hex()} discarded')
+            # fan is still there
+            self.last_seen = time.perf_counter()
+            self._late_responses -= 1
+
+    def _send_file_data(self, data: bytes):
+        """Sends file data by packets and waits for `file received` status.
+
+        Every packet must be taken by fan in `timeout`. After the last one,
+        fan must read the rest of send buffer first, so status is waited
+        for `timeout` per packet that may still be there.
+
+        Args:
+            data (bytes): raw file data
+
+        Raises:
+            TimeoutError: fan stopped reading or did not answer in time
+            ConnectionError: client closed connection
+        """
+        sock = self.file_socket
         # `packet_idx * buff_size` - begin of packet (eg. 3*1460=4380)
-        # `(packet_idx+1) * buff_size` - end of packet (eg. 4*1460=5840)
+        # `(packet_idx+1) * buff_size` - end of packet
         packet_idx = 0
         # if begin of packet NOT less than length of file - break loop
-        while packet_idx * buff_size < len(data):
-            self.client_socket.send(data[packet_idx * buff_size:
-                                         (packet_idx+1) * buff_size])
+        while packet_idx * self.buff_size < len(data):
+            sock.sendall(data[packet_idx * self.buff_size:
+                              (packet_idx+1) * self.buff_size])
             packet_idx += 1
 
-        logger.info(f'File `{file}` was sent')  # using Video.__str__()
+        send_buffer = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        sock.settimeout(self.timeout * (1 + send_buffer // self.buff_size))
+        try:
+            # wait for `file received` status (b'01')
+            if not sock.recv(self.buff_size):
+                raise ConnectionError('Client closed connection')
+        finally:
+            sock.settimeout(self.timeout)
 
-        # receive `change binary mode` status (b'01')
-        response = self.client_socket.recv(self.buff_size)
-        logger.debug('Exit binary mode')
+    def transmit(self,
+                 data: bytes,
+                 is_file: bool = False,
+                 record: bool = True) -> float:
+        """Send raw data and wait for response.
+
+        Commands and files use separate sockets, so command may be sent
+        while file is uploading.
+
+        Args:
+            data (bytes): raw command or file data
+            is_file (bool): if True, data is sent to file socket by packets
+                of `buff_size`
+            record (bool): if False, data is not written to session log
+                (eg. heartbeats)
+
+        Raises:
+            TimeoutError: no matching command response in `timeout`
+                seconds, or upload stalled (see `_send_file_data`)
+            ConnectionError: client closed connection
+
+        Returns:
+            float: time until response was received (s)
+        """
+        if is_file:
+            lock, sock = self._file_lock, self.file_socket
+        else:
+            lock, sock = self._comm_lock, self.comm_socket
+
+        with lock:
+            if is_file:
+                start = time.perf_counter()
+                try:
+                    self._send_file_data(data)
+                except TimeoutError:
+                    # fan stopped reading, rest of stream would be taken
+                    # for the next file, so file connection is closed
+                    sock.shutdown(socket.SHUT_RDWR)
+                    raise
+            else:
+                expected = Command.get_response(data)
+                self._drain_late_responses(len(expected))
+                start = time.perf_counter()
+                sock.sendall(data)
+                try:
+                    response = self._recv_response(len(expected),
+                                                   self.timeout)
+                    # response repeats parameters, so late response to
+                    # earlier command is not taken for this one
+                    while response != expected:
+                        logger.warning(f'Unexpected response '
+                                       f'{response.hex()} discarded')
+                        response = self._recv_response(
+                            len(expected),
+                            start + self.timeout - time.perf_counter())
+                except TimeoutError:
+                    # response may still come, it must not be taken for next
+                    self._late_responses += 1
+                    self._late_deadline = time.perf_counter() + self.timeout
+                    raise
+            latency = time.perf_counter() - start
+            logger.debug('Response received')
+            self.last_seen = time.perf_counter()
+            if not is_file:
+                self.rtt = latency
+
+        if self.recorder is not None and record:
+            if is_file:
+                self.recorder.record_file(data, latency)
+            else:
+                self.recorder.record_command(data, latency)
+        return latency
 
 
 if __name__ == '__main__':
@@ -249,14 +613,34 @@ if __name__ == '__main__':
     Args/Vars:
         client_ip (str): Used to limit client's IP address for connection.
             If empty string, it uses all interfaces.
-        client_port (int): Port number in range [1024, 65535]
+        client_port (int): Port number in range [1024, 65535] for commands
+        file_port (int): Port number in range [1024, 65535] for files.
+            Default `client_port + 1000`
         buff_size (int): Max data size in packet. Default (1460) as in DSEE-65H
+        vmaf (float|None): VMAF target for encoder autotuning.
+            If not given, fixed encoder settings are used.
+        window (int): Command coalescing window in ms. Default 100.
+        fan_fit (bool): Crop video files to holofan display before encoding
+        timeout (float): Max time to wait for command response (s). Default 1
+        heartbeat (float): Heartbeat interval (s). If 0, monitoring is off.
+            Default 0. Heartbeat re-sends last acknowledged setting to idle
+            fan, so changes made by remote or vendor app are reverted.
+        record (str|None): Path to session log. If given, all sent commands
+            and files are recorded for `session.py` replay.
     """
     # parsing command line args
     parser = ArgumentParser()
     parser.add_argument('-i', '--ipaddr', type=str, default='localhost')
     parser.add_argument('-p', '--port', type=int, default=6060)
+    parser.add_argument('-f', '--file-port', type=int, default=None)
     parser.add_argument('-b', '--buff', type=int, default=1460)
+    parser.add_argument('-v', '--vmaf', type=float, default=None)
+    parser.add_argument('-w', '--window', type=int, default=100)
+    parser.add_argument('-r', '--record', type=str, default=None)
+    parser.add_argument('-c', '--fan-fit', action='store_true')
+    parser.add_argument('-t', '--timeout', type=float, default=1.0)
+    # opt-in: probes re-send settings (see `Heartbeat`)
+    parser.add_argument('-e', '--heartbeat', type=float, default=0.0)
     params = parser.parse_args(sys.argv[1:])
 
     # assigning all parameters
@@ -267,12 +651,50 @@ if __name__ == '__main__':
         raise ArgumentTypeError('Invalid port number')
         quit(2)
 
+    file_port = params.file_port or server_port + FILE_PORT_OFFSET
+    if not 1024 <= file_port <= 65535 or file_port == server_port:
+        raise ArgumentTypeError('Invalid file port number')
+        quit(2)
+
     buff_size = params.buff
     if not 1024 <= buff_size <= 1600:
         raise ArgumentTypeError('Invalid buff size number')
         quit(2)
 
-    server = Server(client_ip, server_port, buff_size)
+    autotuner = None
+    if params.vmaf is not None:
+        if not 0 <= params.vmaf <= 100:
+            raise ArgumentTypeError('Invalid VMAF target')
+            quit(2)
+        autotuner = Autotuner(params.vmaf)
+
+    window = params.window
+    if not 0 <= window <= 5000:
+        raise ArgumentTypeError('Invalid coalescing window')
+        quit(2)
+
+    recorder = None
+    if params.record is not None:
+        recorder = SessionRecorder(params.record)
+
+    timeout = params.timeout
+    if not 0 < timeout <= 60:
+        raise ArgumentTypeError('Invalid timeout')
+        quit(2)
+
+    heartbeat_interval = params.heartbeat
+    if not 0 <= heartbeat_interval <= 60:
+        raise ArgumentTypeError('Invalid heartbeat interval')
+        quit(2)
+
+    server = Server(client_ip, server_port, buff_size, autotuner,
+                    window / 1000, recorder, file_port, params.fan_fit,
+                    timeout)
     server.create_connection()
+    if heartbeat_interval > 0:
+        # fan is dead if it missed 3 heartbeats
+        server.heartbeat = Heartbeat([server], heartbeat_interval,
+                                     3 * max(heartbeat_interval, timeout))
+        server.heartbeat.start()
     while True:
         server.menu()
@@ -0,0 +1,217 @@
+import logging
+import os
+import sys
+import threading
+import time
+from argparse import ArgumentParser, ArgumentTypeError
+from command import FILE_PORT_OFFSET, Command
+from start_server import Server
+from video import Video
+
+
+# creating log file
+log_file = os.path.join('..', 'sync_start.log')
+if not os.path.isfile(log_file) or \
+        os.path.getsize(log_file) > 5120:
+    open(log_file, 'w').close()
+fh = logging.FileHandler(log_file, mode="a")
+ftm = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+fh.setFormatter(ftm)
+logger = logging.getLogger('sync_start')
+logger.addHandler(fh)
+logger.setLevel(logging.DEBUG)
+
+
+class SyncStart():
+    def __init__(self, servers: list[Server], probes: int = 8) -> None:
+        """Starts playback on several holofans (video wall) at once.
+
+        Holofans have no clock to synchronize with, so one-way delay of every
+        connection is estimated as half of its min command round-trip time.
+        Start command is sent to every fan earlier by its delay, so all fans
+        receive it at the same moment.
+
+        Args:
+            servers (list[Server]): connected servers, one per holofan
+            probes (int): number of round trips used for delay estimation
+        """
+        if not servers:
+            raise ValueError('At least one server must be given')
+        if probes < 1:
+            raise ValueError('Probes number must be more than 0')
+        self.servers = servers
+        self.probes = probes
+        # estimated one-way delay of every connection (s)
+        self.delays = [0.0] * len(servers)
+        # indices of fans that did not respond, they are skipped
+        self.failed = set()
+
+    def _run_all(self, target, *args) -> list:
+        """Calls `target(idx, server, *args)` for working servers in parallel.
+
+        Fan that does not respond (`TimeoutError` or other `OSError`) is
+        marked as failed and skipped by following calls. Other exceptions
+        of calls are raised again in caller.
+
+        Raises:
+            ConnectionError: all fans failed
+
+        Returns:
+            list: results of calls in order of servers, None for failed fans
+        """
+        results = [None] * len(self.servers)
+        errors = []
+
+        def run(idx, server):
+            try:
+                results[idx] = target(idx, server, *args)
+            except OSError as msg:
+                logger.error(f'Fan {idx} failed: {msg}')
+                self.failed.add(idx)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=run, args=(idx, server))
+                   for idx, server in enumerate(self.servers)
+                   if idx not in self.failed]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        if len(self.failed) == len(self.servers):
+            raise ConnectionError('No holofan responded')
+        return results
+
+    def stage(self, file: Video):
+        """Uploads video file to all holofans and pauses playback.
+
+        Args:
+            file (Video): initiated video file
+        """
+        def stage_one(idx, server, data):
+            server.coalescer.flush()
+            server.transmit(data, is_file=True)
+            server.transmit(Command().pause_playlist().get_data())
+            logger.info(f'Fan {idx}: `{file}` staged')
+
+        # file is encoded once, the same data is sent to all fans
+        self._run_all(stage_one, file.get_data())
+
+    def estimate(self) -> list[float]:
+        """Estimates one-way delay of every connection.
+
+        Paused playlist is paused again, so probes change nothing on fans.
+
+        Returns:
+            list[float|None]: delays (s) in order of servers,
+                None for failed fans
+        """
+        def estimate_one(idx, server):
+            rtts = [server.transmit(Command().pause_playlist().get_data())
+                    for _ in range(self.probes)]
+            # min RTT has the least queueing noise
+            delay = min(rtts) / 2
+            logger.info(f'Fan {idx}: min RTT {min(rtts) * 1000:.2f} ms, '
+                        f'max RTT {max(rtts) * 1000:.2f} ms')
+            return delay
+
+        self.delays = self._run_all(estimate_one)
+        return self.delays
+
+    def start(self, lead: float = 0.05) -> list[float | None]:
+        """Resumes playback on all working holofans at the same moment.
+
+        Args:
+            lead (float): time reserved for threads to start (s)
+
+        Returns:
+            list[float|None]: skew (ms) of estimated start of every fan
+                from the earliest one, None for failed fans
+        """
+        target = time.perf_counter() + lead + max(
+            delay for idx, delay in enumerate(self.delays)
+            if idx not in self.failed
+        )
+
+        def start_one(idx, server):
+            # sleep only: spinning threads of other fans would hold GIL
+            # and delay this one by up to switch interval (5 ms)
+            remaining = target - self.delays[idx] - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            sent = time.perf_counter()
+            rtt = server.transmit(Command().resume_playlist().get_data())
+            # estimated moment when fan received command
+            return sent + rtt / 2
+
+        arrivals = self._run_all(start_one)
+        first = min(arrival for arrival in arrivals if arrival is not None)
+        skews = [None if arrival is None else (arrival - first) * 1000
+                 for arrival in arrivals]
+        for idx, skew in enumerate(skews):
+            if skew is not None:
+                logger.info(f'Fan {idx}: skew {skew:.2f} ms')
+        return skews
+
+
+if __name__ == '__main__':
+    """Plays video file on several holofans at once.
+
+    This section parses command-line arguments, waits for every holofan
+    connection (one port per holofan) and starts synchronized playback.
+
+    Args/Vars:
+        file_name (str): name of video file in `media` folder
+        client_ip (str): Used to limit client's IP address for connection.
+        ports (list[int]): Port numbers in range [1024, 65535] for commands
+        file_ports (list[int]): Port numbers in range [1024, 65535] for
+            files, one per command port. Default `port + 1000` for each
+        buff_size (int): Max data size in packet. Default (1460) as in DSEE-65H
+    """
+    # parsing command line args
+    parser = ArgumentParser()
+    parser.add_argument('file_name', type=str)
+    parser.add_argument('-i', '--ipaddr', type=str, default='localhost')
+    parser.add_argument('-p', '--ports', type=int, nargs='+', default=[6060])
+    parser.add_argument('-f', '--file-ports', type=int, nargs='+',
+                        default=None)
+    parser.add_argument('-b', '--buff', type=int, default=1460)
+    params = parser.parse_args(sys.argv[1:])
+
+    file_ports = params.file_ports or \
+        [port + FILE_PORT_OFFSET for port in params.ports]
+    if len(file_ports) != len(params.ports):
+        raise ArgumentTypeError('Number of file ports must match ports')
+        quit(2)
+    all_ports = params.ports + file_ports
+    for port in all_ports:
+        if not 1024 <= port <= 65535:
+            raise ArgumentTypeError('Invalid port number')
+            quit(2)
+    if len(set(all_ports)) != len(all_ports):
+        raise ArgumentTypeError('Ports must not repeat')
+        quit(2)
+    if not 1024 <= params.buff <= 1600:
+        raise ArgumentTypeError('Invalid buff size number')
+        quit(2)
+
+    servers = [Server(params.ipaddr, port, params.buff, file_port=file_port)
+               for port, file_port in zip(params.ports, file_ports)]
+    # all ports are opened first, so fans may connect in any order
+    for server in servers:
+        server.listen()
+    for server in servers:
+        server.accept()
+
+    sync_start = SyncStart(servers)
+    file_path = os.path.join('..', 'media', params.file_name)
+    sync_start.stage(Video(os.path.abspath(file_path)))
+    sync_start.estimate()
+    for idx, skew in enumerate(sync_start.start()):
+        if skew is None:
+            print(f'Fan {idx} (port {params.ports[idx]}): failed')
+        else:
+            print(f'Fan {idx} (port {params.ports[idx]}): '
+                  f'skew {skew:.2f} ms')
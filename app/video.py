@@ -1,7 +1,8 @@
 import binascii
 import logging
 import os
-from subprocess import check_output
+import threading
+from subprocess import DEVNULL, check_call, check_output
 
 
 # creating log file
@@ -23,6 +24,20 @@ else:  # dos-like:
     FFMPEG = '..\\ffmpeg\\bin\\ffmpeg.exe'
     FFPROBE = '..\\ffmpeg\\bin\\ffprobe.exe'
 
+# side of square frame displayed by holofan (px)
+FAN_RESOLUTION = 1024
+# cached masks of holofan display (see `Video.get_fan_mask`)
+MASK_FOLDER = os.path.join('..', 'media', 'masks')
+_mask_lock = threading.Lock()
+
+# x264 rate control used when no other settings are given (see `Video.encode`)
+DEFAULT_SETTINGS = {
+    'bitrate': 1000,  # kbit/s
+    'preset': 'medium',
+    'height': None,  # None keeps source resolution
+    'fan_fit': False,  # crop to circle of holofan (see `Video.fan_fit`)
+}
+
 
 class Video():
     def __init__(self, path: str) -> None:
@@ -44,6 +59,8 @@ class Video():
             open(path, 'a').close()  # create file
 
         self._packet = b''
+        # settings for `encode`, may be replaced (eg. by `Autotuner.tune`)
+        self.encode_settings = dict(DEFAULT_SETTINGS)
 
         get_fps_command = (f'{FFPROBE} -v quiet -i {self.path} '
                            f'-show_entries stream=r_frame_rate -of csv=p=0')
@@ -71,18 +88,150 @@ class Video():
             result += f'{self._file_size / 2**10:.2} kiB'
         else:
             result += f'{self._file_size / 2**20:.2} MiB'
+        return result
 
-    def encode(self):
-        """Encodes video file using a preset FFMPEG command."""
-        command = (
-            f'{FFMPEG} -v quiet -y -i {self.path}'
-            f'-c:v libx264 -sc_threshold 0 '
-            f'-x264-params cabac=0:ref=1:mixed_ref=0:8x8dct=0:'
-            f'threads=6:lookahead_threads=1:bframes=0:weightp=0:rc=cbr:'
-            f'bitrate=1000:ratetol=1.0:vbv_maxrate=1000:vbv_bufsize=2000:'
-            f'nal_hrd=none:filler=0 {self.path}'
+    @staticmethod
+    def settings_tag(settings: dict) -> str:
+        """Returns short str tag of encoder settings, used in file names.
+
+        Args:
+            settings (dict): encoder settings (see `DEFAULT_SETTINGS`)
+
+        Returns:
+            str: tag, eg. `1000k_medium_src`
+        """
+        height = settings['height']
+        return (f'{settings["bitrate"]}k_{settings["preset"]}_'
+                f'{f"{height}p" if height else "src"}'
+                f'{"_fit" if settings.get("fan_fit", False) else ""}')
+
+    @staticmethod
+    def get_fan_mask(size: int = FAN_RESOLUTION) -> str:
+        """Returns path to mask of holofan display, creating it once.
+
+        Mask is a single RGBA image: transparent inside circle inscribed in
+        square of `size`, black outside it. It is calculated only once per
+        size, so encoding just overlays it on every frame.
+
+        Args:
+            size (int): side of square frame (px)
+
+        Returns:
+            str: path to PNG file
+        """
+        path = os.path.join(MASK_FOLDER, f'fan_mask_{size}.png')
+        with _mask_lock:  # autotuner encodes in parallel
+            if not os.path.isfile(path):
+                os.makedirs(MASK_FOLDER, exist_ok=True)
+                check_call([
+                    FFMPEG, '-v', 'quiet', '-y', '-f', 'lavfi',
+                    '-i', f'color=c=black:s={size}x{size},format=rgba',
+                    '-vf', "geq=r=0:g=0:b=0:"
+                           "a='255*gt(hypot(X+0.5-W/2,Y+0.5-H/2),W/2)'",
+                    '-frames:v', '1', path
+                ], stdout=DEVNULL, stderr=DEVNULL)
+                logger.info(f'Fan mask {path} was created')
+        return path
+
+    @staticmethod
+    def fan_fit(size: int = FAN_RESOLUTION,
+                video: str = '0:v',
+                mask: str = '1:v') -> str:
+        """Returns FFMPEG filter graph fitting video to holofan display.
+
+        Video is scaled to cover square of `size`, cropped to it and
+        covered with mask (see `Video.get_fan_mask`), so everything outside
+        inscribed circle is black. Holofan shows only that circle, and
+        black pixels are almost free to encode.
+
+        Args:
+            size (int): side of square frame (px)
+            video (str): label of video input
+            mask (str): label of mask input
+
+        Returns:
+            str: filter graph, its output must be labeled by caller
+        """
+        return (
+            f'[{video}]scale={size}:{size}:force_original_aspect_ratio='
+            f'increase,crop={size}:{size},setsar=1[fit];'
+            # single mask frame is repeated for every video frame
+            f'[fit][{mask}]overlay=eof_action=repeat,format=yuv420p'
         )
-        os.system(command)
+
+    def encoded_path(self, settings: dict | None = None) -> str:
+        """Returns path of transcoded file for given encoder settings.
+
+        Transcodes are kept in `encoded` folder next to source file, so they
+        can be reused while source file is unchanged.
+
+        Args:
+            settings (dict, optional): encoder settings.
+                Defaults to `self.encode_settings`.
+
+        Returns:
+            str: path to transcoded file
+        """
+        if settings is None:
+            settings = self.encode_settings
+        stem, ext = os.path.splitext(self.name)
+        return os.path.join(self.folder, 'encoded',
+                            f'{stem}.{Video.settings_tag(settings)}{ext}')
+
+    def encode(self,
+               settings: dict | None = None,
+               output_path: str | None = None) -> str:
+        """Encodes video file using a preset FFMPEG command.
+
+        Args:
+            settings (dict, optional): encoder settings: `bitrate` (kbit/s),
+                `preset` (x264 preset), `height` (px or None), `fan_fit`
+                (bool, if True, video is fitted to holofan display with
+                side of `height` or `FAN_RESOLUTION`).
+                Defaults to `self.encode_settings`.
+            output_path (str, optional): path to output file.
+                Defaults to `self.encoded_path(settings)`.
+
+        Returns:
+            str: path to encoded file
+        """
+        if settings is None:
+            settings = self.encode_settings
+        if output_path is None:
+            output_path = self.encoded_path(settings)
+
+        # reuse transcode if it is newer than source
+        if os.path.isfile(output_path) and \
+                os.path.getmtime(output_path) >= os.path.getmtime(self.path):
+            logger.debug(f'Using cached transcode {output_path}')
+            return output_path
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        bitrate = settings['bitrate']
+        command = [FFMPEG, '-v', 'quiet', '-y', '-i', self.path]
+        if settings.get('fan_fit', False):
+            size = settings['height'] or FAN_RESOLUTION
+            size -= size % 2
+            command += [
+                '-i', Video.get_fan_mask(size),
+                '-filter_complex', f'{Video.fan_fit(size)}[fit]',
+                '-map', '[fit]', '-map', '0:a?'
+            ]
+        elif settings['height']:
+            command += ['-vf', f'scale=-2:{settings["height"]}']
+        command += [
+            '-c:v', 'libx264', '-preset', settings['preset'],
+            '-sc_threshold', '0',
+            '-x264-params',
+            f'cabac=0:ref=1:mixed_ref=0:8x8dct=0:'
+            f'threads=6:lookahead_threads=1:bframes=0:weightp=0:rc=cbr:'
+            f'bitrate={bitrate}:ratetol=1.0:vbv_maxrate={bitrate}:'
+            f'vbv_bufsize={2 * bitrate}:nal_hrd=none:filler=0',
+            output_path
+        ]
+        logger.debug(' '.join(command))
+        check_call(command, stdout=DEVNULL, stderr=DEVNULL)
+        return output_path
 
     def get_data(self) -> bytes:
         """Create raw data (`self._packet`) for further sending.
@@ -90,12 +239,14 @@ class Video():
         Returns:
             bytes: raw packet data
         """
-        self.encode()
+        encoded_path = self.encode()
+        file_size = os.path.getsize(encoded_path)
+        logger.info(f'Encoded file size: {file_size}')
         # create file header
-        self._packet = binascii.unhexlify(f'{int(self._file_size):0>20x}')
+        self._packet = binascii.unhexlify(f'{int(file_size):0>20x}')
         self._packet += binascii.unhexlify(b'0000000000')
         self._packet += binascii.unhexlify(f'{self._name_len:02x}')
         self._packet += self.name.encode('ascii', 'backslashreplace')
-        with open(self.path, 'rb') as file:
+        with open(encoded_path, 'rb') as file:
             self._packet += file.read()
         return self._packet